@@ -7,16 +7,46 @@ Defines the LangGraph agent workflow for the RAG application:
 3. Handles chat queries using retrieval-augmented generation.
 """
 
+import asyncio
+import operator
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from langgraph.graph import StateGraph, START, END
 from typing_extensions import TypedDict
-from typing import List, Dict, Any
+from typing import Annotated, List, Dict, Any
 from embedder import EmbeddingGenerator
 from vector_store import ChromaDBManager
-from openai import OpenAI
-from settings import OPENAI_API_KEY, GITHUB_TOKEN, CHROMA_DB_DIR
+from openai import AsyncOpenAI
+from settings import OPENAI_API_KEY, GITHUB_TOKEN, CHROMA_DB_DIR, MAX_FILE_BYTES
 from repo_crawler import GitHubRepoCrawler
-from chunker import CodeChunker
+from chunker import ENCODING, ChunkBatch, CodeChunker
 from embedder import EmbeddingGenerator
+
+# Number of files fetched from GitHub in parallel
+FETCH_WORKERS = 16
+
+# Number of chunks buffered before they are embedded and stored
+STORE_BATCH_SIZE = 512
+
+# Number of chunk buffers embedded on background threads while fetching continues
+EMBED_WORKERS = 8
+
+# Repositories with more code files than this are downloaded as one ZIP archive,
+# unless the archive is larger than ARCHIVE_MAX_BYTES
+ARCHIVE_MIN_FILES = 50
+ARCHIVE_MAX_BYTES = 100_000_000
+
+# Maximum number of tokens of retrieved code sent to the LLM per question
+CONTEXT_TOKEN_BUDGET = 2500
+
+# Matches https://github.com/<owner>/<repo> and captures owner and repo
+_GITHUB_URL_RE = re.compile(r"^https://github\.com/([^/]+)/([^/]+)")
+
+# Characters not allowed in a collection name
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9_]")
+
 class RAGState(TypedDict):
     repo_url: str
     valid: bool
@@ -24,12 +54,37 @@ class RAGState(TypedDict):
     chunks: list
     embeddings: list
     collection_name: str
-    chat_history: List[Dict[str, str]]
+    chat_history: Annotated[List[Dict[str, str]], operator.add]  # Nodes return only the new messages
     answer: str
     owner: str
     repo: str
     mode: str  # "process_repo" or "chat_only"
     processed: bool
+    head_sha: str  # Commit to process the repo at; empty for the head of the main branch
+
+# Clients shared by every node invocation, created lazily on first use
+_embedder_singleton = None
+_chroma_singleton = None
+_singleton_lock = threading.Lock()
+
+def get_embedder():
+    """Return the process-wide EmbeddingGenerator, creating it on first use."""
+    global _embedder_singleton
+    if _embedder_singleton is None:
+        with _singleton_lock:
+            if _embedder_singleton is None:
+                _embedder_singleton = EmbeddingGenerator(api_key=OPENAI_API_KEY)
+    return _embedder_singleton
+
+def get_chroma():
+    """Return the process-wide ChromaDBManager, creating it on first use."""
+    global _chroma_singleton
+    if _chroma_singleton is None:
+        with _singleton_lock:
+            if _chroma_singleton is None:
+                _chroma_singleton = ChromaDBManager(persist_directory=CHROMA_DB_DIR)
+    return _chroma_singleton
+
 def sanitize_collection_name(owner, repo):
     """
     Sanitize collection name to meet ChromaDB requirements:
@@ -42,11 +97,9 @@ def sanitize_collection_name(owner, repo):
     # Combine owner and repo with underscore
     raw_name = f"{owner}_{repo}"
     
-    # Replace hyphens with underscores (ChromaDB doesn't like hyphens)
-    sanitized = raw_name.replace('-', '_')
-    
-    # Remove any characters that aren't alphanumeric or underscore
-    sanitized = ''.join(c for c in sanitized if c.isalnum() or c == '_')
+    # Replace hyphens with underscores (ChromaDB doesn't like hyphens), then
+    # remove any characters that aren't alphanumeric or underscore
+    sanitized = _SANITIZE_RE.sub('', raw_name.replace('-', '_'))
     
     # Ensure it starts and ends with alphanumeric
     sanitized = sanitized.strip('_')
@@ -64,6 +117,19 @@ def sanitize_collection_name(owner, repo):
         sanitized = sanitized[:-1] + 'x'
     
     return sanitized
+def parse_repo_url(url):
+    """
+    Extracts owner and repository name from a GitHub URL.
+
+    Args:
+        url (str): Repository URL
+
+    Returns:
+        tuple: (owner, repo), or None if the URL is not a GitHub repository URL
+    """
+    match = _GITHUB_URL_RE.match(url)
+    return (match.group(1), match.group(2)) if match else None
+
 def validate_url_node(state):
     """
     Checks if the input is a valid GitHub URL and extracts owner/repo.
@@ -74,20 +140,128 @@ def validate_url_node(state):
     Returns:
         dict: Updated state with owner/repo or error
     """
-    import re
-    url = state["repo_url"]
-    pattern = r"^https://github.com/([^/]+)/([^/]+)"
-    match = re.match(pattern, url)
-    if match:
+    parsed = parse_repo_url(state["repo_url"])
+    if parsed:
         return {
             "valid": True, 
-            "owner": match.group(1), 
-            "repo": match.group(2),
+            "owner": parsed[0], 
+            "repo": parsed[1],
             "error": ""
         }
     else:
         return {"valid": False, "error": "Invalid GitHub URL"}
 
+def build_context(documents, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Joins retrieved documents in ranking order, stopping before the first one that
+    would exceed the token budget. The top-ranked document is always kept.
+
+    Args:
+        documents (list): Retrieved chunk texts, best match first
+        token_budget (int): Maximum number of tokens to keep
+
+    Returns:
+        str: Context for the LLM prompt
+    """
+    kept, used = [], 0
+    for doc, ids in zip(documents, ENCODING.encode_ordinary_batch(documents)):
+        tokens = len(ids)
+        if kept and used + tokens > token_budget:
+            break
+        kept.append(doc)
+        used += tokens
+    return "\n\n".join(kept)
+
+def iter_repo_files(crawler, owner, repo, code_files, ref="main", tree_bytes=None):
+    """
+    Yields the content of the repository's code files, from a single archive
+    download for larger repositories and from concurrent per-file fetches otherwise.
+
+    Args:
+        crawler (GitHubRepoCrawler): Crawler to fetch with
+        owner (str): Repository owner
+        repo (str): Repository name
+        code_files (list): Filtered file metadata dicts from get_files
+        ref (str): Branch name or commit SHA to fetch the files at
+        tree_bytes (int): Total size of all files in the tree, as an estimate of the archive size (optional)
+
+    Yields:
+        tuple: (file_path, content) pairs
+    """
+    # Skip the archive up front when the tree listing already shows it is too large,
+    # so those bytes are not downloaded only to be fetched again file by file
+    if len(code_files) > ARCHIVE_MIN_FILES and (tree_bytes or 0) <= ARCHIVE_MAX_BYTES:
+        try:
+            archive = crawler.download_archive(owner, repo, branch=ref, max_bytes=ARCHIVE_MAX_BYTES)
+        except ValueError:
+            pass  # Archive larger than estimated; fetch the code files individually
+        else:
+            with archive:
+                yield from crawler.iter_code_files(archive, max_file_bytes=MAX_FILE_BYTES)
+            return
+    file_paths = [file_info['path'] for file_info in code_files]
+    yield from crawler.get_files_content_bulk(owner, repo, file_paths, branch=ref, max_workers=FETCH_WORKERS)
+
+def iter_chunk_batches(chunker, files, owner, repo, batch_size=STORE_BATCH_SIZE):
+    """
+    Chunks files as they arrive and groups the chunks into buffers of about batch_size.
+
+    Args:
+        chunker (CodeChunker): Chunker to split the files with
+        files (iterable): (file_path, content) pairs
+        owner (str): Repository owner
+        repo (str): Repository name
+        batch_size (int): Number of chunks after which a buffer is yielded
+
+    Yields:
+        ChunkBatch: Buffers of chunks, the last one possibly smaller
+    """
+    pending = ChunkBatch(owner, repo)
+    for file_path, content in files:
+        if content:  # Only process if content exists
+            pending.extend(chunker.chunk_by_lines(content, file_path, owner, repo))
+        if len(pending) >= batch_size:
+            yield pending
+            pending = ChunkBatch(owner, repo)
+    if pending:
+        yield pending
+
+def store_chunk_batches(chroma, collection, batches, max_in_flight=EMBED_WORKERS):
+    """
+    Embeds buffers of chunks on background threads and stores them in the vector database,
+    so fetching and chunking the next files continues while earlier buffers are embedded.
+
+    Args:
+        chroma (ChromaDBManager): Vector store manager
+        collection (chromadb.Collection): The collection to store in
+        batches (iterable): ChunkBatch buffers to store
+        max_in_flight (int): Maximum number of buffers being embedded at once
+
+    Returns:
+        set: IDs of the stored rows
+    """
+    embedder = get_embedder()
+    in_flight = deque()  # (chunks, embeddings future) pairs, oldest first
+    stored = set()
+
+    def store_oldest():
+        chunks, future = in_flight.popleft()
+        stored.update(chroma.store_chunks(collection, chunks, future.result()))
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        try:
+            for chunks in batches:
+                in_flight.append((chunks, executor.submit(embedder.generate_batch_embeddings, chunks.contents)))
+                # Store finished buffers in order, blocking on the oldest only once every worker is busy
+                while in_flight and (len(in_flight) > max_in_flight or in_flight[0][1].done()):
+                    store_oldest()
+            while in_flight:
+                store_oldest()
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    return stored
+
 def process_repo_node(state):
     """
     Crawls the repo, chunks code, generates embeddings, and stores them.
@@ -96,7 +270,7 @@ def process_repo_node(state):
         state (dict): Current agent state
 
     Returns:
-        dict: Updated state with chunks, embeddings, and collection name
+        dict: Updated state with the collection name
     """
     try:
 
@@ -104,40 +278,37 @@ def process_repo_node(state):
         owner, repo = state["owner"], state["repo"]
         
         # Initialize components
-        crawler = GitHubRepoCrawler(token=GITHUB_TOKEN)
-        files = crawler.get_files(owner, repo)
-        # code_files = [f for f in files if crawler.is_code_file(f['path'])]
-        code_files = [f for f in files] #Include also files which are not code: README.md and so on
+        crawler = GitHubRepoCrawler(token=GITHUB_TOKEN, pool_size=FETCH_WORKERS)
+        # List and fetch everything at the commit resolved by the caller, so the file list
+        # and the contents come from the same snapshot even if the branch moves meanwhile
+        ref = state.get("head_sha") or "main"
+        # Skip binaries, assets and oversized files before fetching anything;
+        # is_code_file also accepts docs such as README.md
+        tree = crawler.get_files(owner, repo, ref)
+        code_files = list(crawler.filter_code_blobs(tree, max_file_bytes=MAX_FILE_BYTES))
 
         if not code_files:
             return {"error": "No files found in the repository", "valid": False}
         
-        # Chunk the code
+        # Chunks are embedded and stored in batches as files arrive, so memory stays flat
         chunker = CodeChunker()
-        all_chunks = []
+        chroma = get_chroma()
+        collection_name = sanitize_collection_name(owner, repo)
+        collection = chroma.create_or_get_collection(collection_name)
         # repo_info = {'owner': owner, 'repo': repo}
         
-        for file_info in code_files:
-            content = crawler.get_file_content(owner, repo, file_info['path'])
-            if content:  # Only process if content exists
-                all_chunks.extend(chunker.chunk_by_lines(content, file_info['path'], owner, repo))
+        # Chunk each file as it arrives
+        tree_bytes = sum(item.get('size', 0) for item in tree)
+        files = iter_repo_files(crawler, owner, repo, code_files, ref, tree_bytes)
+        stored = store_chunk_batches(chroma, collection, iter_chunk_batches(chunker, files, owner, repo))
         
-        if not all_chunks:
+        if not stored:
             return {"error": "No content could be extracted from the repository", "valid": False}
         
-        # Generate embeddings
-        embedder = EmbeddingGenerator(api_key=OPENAI_API_KEY)
-        embeddings = embedder.generate_batch_embeddings([c['content'] for c in all_chunks])
-        
-        # Store in vector database
-        chroma = ChromaDBManager(persist_directory=CHROMA_DB_DIR)
-        collection_name = sanitize_collection_name(owner, repo)
-        collection = chroma.create_or_get_collection(collection_name)
-        chroma.store_chunks(collection, all_chunks, embeddings)
+        # Every commit is stored in the same collection; drop what this run did not rewrite
+        chroma.finalize_collection(collection, stored, state.get("head_sha") or "")
         
         return {
-            "chunks": all_chunks, 
-            "embeddings": embeddings, 
             "collection_name": collection_name,
             "processed": True,
             "error": ""
@@ -146,10 +317,13 @@ def process_repo_node(state):
     except Exception as e:
         return {"error": f"Error processing repository: {str(e)}", "valid": False}
 
-def chat_node(state):
+async def chat_node(state):
     """
     Handles a chat query: retrieves similar code and asks GPT-4o mini for an answer.
 
+    The query embedding request runs while the collection is resolved and the
+    prompts are prepared.
+
     Args:
         state (dict): Current agent state
 
@@ -173,17 +347,10 @@ def chat_node(state):
         
         query = state["chat_history"][-1]["content"]
         
-        # Generate query embedding
-        embedder = EmbeddingGenerator(api_key=OPENAI_API_KEY)
-        query_embedding = embedder.generate_embedding(query)
-        
-        # Retrieve similar code chunks
-        chroma = ChromaDBManager(persist_directory=CHROMA_DB_DIR)
-        collection = chroma.create_or_get_collection(state["collection_name"])
-        results = chroma.query_similar_code(collection, query_embedding, n_results=5)
-        
-        # Prepare context from retrieved chunks
-        context = "\n\n".join([doc for doc in results['documents'][0]])
+        # Start the query embedding request and the collection lookup concurrently
+        embedding_task = asyncio.create_task(get_embedder().agenerate_embedding(query))
+        chroma = get_chroma()
+        collection_task = asyncio.create_task(asyncio.to_thread(chroma.create_or_get_collection, state["collection_name"]))
         
         # Prepare conversation history for context
         conversation_context = ""
@@ -195,9 +362,6 @@ def chat_node(state):
                 elif msg["role"] == "assistant":
                     conversation_context += f"Previous Answer: {msg['content']}\n"
         
-        # Generate response using OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
         system_prompt = f"""You are a helpful codebase assistant for the GitHub repository {state.get('owner', '')}/{state.get('repo', '')}. 
         
 Your task is to answer questions about the codebase using the provided context from the repository's code.
@@ -210,6 +374,14 @@ Guidelines:
 - Be conversational and helpful
 - Consider the conversation history when providing context-aware responses"""
 
+        # Retrieve similar code chunks once the embedding and collection are ready
+        query_embedding = await embedding_task
+        collection = await collection_task
+        results = await chroma.aquery_similar_code_mmr(collection, query_embedding, n_results=5)
+        
+        # Prepare context from retrieved chunks, within the token budget
+        context = build_context(results['documents'][0])
+
         user_prompt = f"""Context from codebase:
 {context}
 
@@ -219,25 +391,24 @@ Current Question: {query}
 
 Please provide a helpful answer based on the codebase context."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
+        # Generate response using OpenAI
+        async with AsyncOpenAI(api_key=OPENAI_API_KEY) as client:
+            response = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.7,
+                max_tokens=1000
+            )
         
         answer = response.choices[0].message.content
         
-        # Update chat history with assistant response
-        updated_history = state["chat_history"].copy()
-        updated_history.append({"role": "assistant", "content": answer})
-        
+        # The chat_history reducer appends the assistant response to the existing history
         return {
             "answer": answer,
-            "chat_history": updated_history,
+            "chat_history": [{"role": "assistant", "content": answer}],
             "error": ""
         }
     
@@ -4,8 +4,58 @@ chunker.py
 Splits code files into manageable chunks for embedding, using token limits and overlap.
 """
 
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from itertools import accumulate
+
 import tiktoken
 
+# GPT-4o mini tokenizer, loaded once at import and shared by every CodeChunker
+# and by the agent's context budgeting
+ENCODING = tiktoken.get_encoding("o200k_base")
+
+@dataclass
+class ChunkBatch:
+    """
+    Chunks of one repository stored as parallel lists, one entry per chunk.
+    """
+    owner: str
+    repo: str
+    contents: list = field(default_factory=list)
+    file_paths: list = field(default_factory=list)
+    start_lines: list = field(default_factory=list)
+    end_lines: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.contents)
+
+    def append(self, content, file_path, start_line, end_line):
+        """
+        Adds a single chunk.
+
+        Args:
+            content (str): Chunk text
+            file_path (str): Path to the file the chunk comes from
+            start_line (int): First line of the chunk (1-based)
+            end_line (int): Last line of the chunk (inclusive)
+        """
+        self.contents.append(content)
+        self.file_paths.append(file_path)
+        self.start_lines.append(start_line)
+        self.end_lines.append(end_line)
+
+    def extend(self, other):
+        """
+        Appends all chunks of another batch from the same repository.
+
+        Args:
+            other (ChunkBatch): Batch to append
+        """
+        self.contents.extend(other.contents)
+        self.file_paths.extend(other.file_paths)
+        self.start_lines.extend(other.start_lines)
+        self.end_lines.extend(other.end_lines)
+
 class CodeChunker:
     """
     Splits code into chunks of a specified token size, with optional overlap.
@@ -18,7 +68,7 @@ class CodeChunker:
         """
         self.max_chunk_size = max_chunk_size
         self.chunk_overlap = chunk_overlap
-        self.encoding = tiktoken.get_encoding("o200k_base")  # GPT-4o mini tokenizer
+        self.encoding = ENCODING
 
     def count_tokens(self, text):
         """
@@ -30,7 +80,27 @@ class CodeChunker:
         Returns:
             int: Number of tokens
         """
-        return len(self.encoding.encode(text))
+        return len(self.encoding.encode_ordinary(text))
+
+    def line_token_counts(self, lines):
+        """
+        Counts the tokens of each line from a single encode of the whole text.
+
+        Every token is attributed to the line it starts on, so the counts sum to the
+        true token count of the joined text, including BPE merges across newlines.
+
+        Args:
+            lines (list): Lines of the text, without their trailing newlines
+
+        Returns:
+            list: Number of tokens attributed to each line
+        """
+        ids = self.encoding.encode_ordinary('\n'.join(lines))
+        # Byte offset of the start of every token and of every line
+        token_starts = list(accumulate(map(len, self.encoding.decode_tokens_bytes(ids)), initial=0))
+        line_starts = accumulate((len(line.encode('utf-8')) + 1 for line in lines[:-1]), initial=0)
+        first_tokens = [bisect_left(token_starts, start, hi=len(ids)) for start in line_starts] + [len(ids)]
+        return [first_tokens[k + 1] - first_tokens[k] for k in range(len(lines))]
 
     def chunk_by_lines(self, content, file_path, owner,repo):
         """
@@ -43,37 +113,21 @@ class CodeChunker:
             repo (str): Repository's name
 
         Returns:
-            list: List of chunk dicts with content and metadata
+            ChunkBatch: The chunks with their line ranges
         """
         lines = content.split('\n')
-        chunks, current_chunk, current_tokens, start_line = [], [], 0, 1
-        for i, line in enumerate(lines, 1):
-            line_tokens = self.count_tokens(line + '\n')
-            if current_tokens + line_tokens > self.max_chunk_size and current_chunk:
-                chunk_content = '\n'.join(current_chunk)
-                chunks.append({
-                    "content": chunk_content,
-                    "file_path": file_path,
-                    "start_line": start_line,
-                    "end_line": i - 1,
-                    "owner": owner,
-                    "repo": repo
-                })
-                overlap_lines = current_chunk[-self.chunk_overlap:] if self.chunk_overlap else []
-                current_chunk = overlap_lines + [line]
-                current_tokens = sum(self.count_tokens(l + '\n') for l in current_chunk)
-                start_line = i - len(overlap_lines)
-            else:
-                current_chunk.append(line)
-                current_tokens += line_tokens
-        if current_chunk:
-            chunk_content = '\n'.join(current_chunk)
-            chunks.append({
-                "content": chunk_content,
-                "file_path": file_path,
-                "start_line": start_line,
-                "end_line": len(lines),
-                "owner": owner,
-                "repo": repo
-            })
+        line_tokens = self.line_token_counts(lines)
+        # prefix[i] is the token count of lines[:i], so any window is measured in O(1)
+        prefix = list(accumulate(line_tokens, initial=0))
+        chunks, start_idx = ChunkBatch(owner, repo), 0
+        for i in range(len(lines)):
+            if prefix[i + 1] - prefix[start_idx] > self.max_chunk_size and i > start_idx:
+                chunks.append('\n'.join(lines[start_idx:i]), file_path, start_idx + 1, i)
+                # Carry over the trailing lines that fit in chunk_overlap tokens, always
+                # advancing past the previous start so every chunk makes progress
+                start_idx = bisect_left(prefix, prefix[i] - self.chunk_overlap, start_idx + 1, i)
+                if prefix[i + 1] - prefix[start_idx] > self.max_chunk_size:
+                    # Line i is too large to join the whole overlap; keep only as much of it as fits
+                    start_idx = bisect_left(prefix, prefix[i + 1] - self.max_chunk_size, start_idx, i)
+        chunks.append('\n'.join(lines[start_idx:]), file_path, start_idx + 1, len(lines))
         return chunks
@@ -4,7 +4,48 @@ embedder.py
 Generates vector embeddings for code chunks using OpenAI's embedding API.
 """
 
-from openai import OpenAI
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import tiktoken
+from openai import AsyncOpenAI, OpenAI, BadRequestError
+
+# Per-request limits of the OpenAI embeddings API (token budget kept slightly under 300k)
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 290_000
+
+# Number of embedding requests kept in flight at once
+MAX_CONCURRENT_REQUESTS = 8
+
+# Process-wide LRU cache of single-text embeddings: (model, sha256 of text) -> (timestamp, embedding)
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 300  # seconds
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+def _cached_embedding(key):
+    """Returns the cached embedding for key, or None if missing or expired."""
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is None:
+            return None
+        stamp, embedding = entry
+        if time.monotonic() - stamp > QUERY_CACHE_TTL:
+            del _query_cache[key]
+            return None
+        _query_cache.move_to_end(key)
+        return embedding
+
+def _cache_embedding(key, embedding):
+    """Stores an embedding, evicting the least recently used entries beyond the cache size."""
+    with _query_cache_lock:
+        _query_cache[key] = (time.monotonic(), embedding)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
 
 class EmbeddingGenerator:
     """
@@ -16,12 +57,17 @@ class EmbeddingGenerator:
             api_key (str): OpenAI API key
             model (str): Embedding model name
         """
+        self.api_key = api_key
         self.client = OpenAI(api_key=api_key)
         self.model = model
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")  # Tokenizer of the text-embedding-3 models
 
     def generate_embedding(self, text):
         """
-        Generates an embedding for a single text.
+        Generates an embedding for a single text, reusing recent results for identical text.
 
         Args:
             text (str): The text to embed
@@ -29,23 +75,131 @@ class EmbeddingGenerator:
         Returns:
             list: Embedding vector
         """
-        response = self.client.embeddings.create(model=self.model, input=text)
-        return response.data[0].embedding
+        key = (self.model, hashlib.sha256(text.encode('utf-8')).hexdigest())
+        embedding = _cached_embedding(key)
+        if embedding is None:
+            response = self.client.embeddings.create(model=self.model, input=text)
+            embedding = response.data[0].embedding
+            _cache_embedding(key, embedding)
+        return embedding
+
+    async def agenerate_embedding(self, text):
+        """
+        Asynchronously generates an embedding for a single text, sharing the cache of generate_embedding.
+
+        Args:
+            text (str): The text to embed
+
+        Returns:
+            list: Embedding vector
+        """
+        key = (self.model, hashlib.sha256(text.encode('utf-8')).hexdigest())
+        embedding = _cached_embedding(key)
+        if embedding is None:
+            async with AsyncOpenAI(api_key=self.api_key) as client:
+                response = await client.embeddings.create(model=self.model, input=text)
+            embedding = response.data[0].embedding
+            _cache_embedding(key, embedding)
+        return embedding
+
+    def pack_batches(self, texts, batch_size=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
+        """
+        Groups texts into consecutive batches that fit the API's per-request limits.
+
+        Args:
+            texts (list): List of strings to embed
+            batch_size (int): Maximum number of texts per batch
+            max_tokens (int): Maximum total tokens per batch
+
+        Returns:
+            list: List of batches (lists of strings), in input order
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for text, ids in zip(texts, self.encoding.encode_ordinary_batch(texts)):
+            if batch and (len(batch) == batch_size or batch_tokens + len(ids) > max_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += len(ids)
+        if batch:
+            batches.append(batch)
+        return batches
 
-    def generate_batch_embeddings(self, texts, batch_size=20):
+    async def _aembed_batch(self, client, semaphore, batch):
+        """
+        Embeds one batch, halving it and retrying if the API rejects the request.
+
+        Args:
+            client (openai.AsyncOpenAI): Client bound to the running event loop
+            semaphore (asyncio.Semaphore): Limits the number of requests in flight
+            batch (list): List of strings to embed
+
+        Returns:
+            list: List of embedding vectors
+        """
+        try:
+            async with semaphore:
+                response = await client.embeddings.create(model=self.model, input=batch)
+        except BadRequestError:
+            if len(batch) == 1:
+                raise
+            mid = len(batch) // 2
+            first, second = await asyncio.gather(
+                self._aembed_batch(client, semaphore, batch[:mid]),
+                self._aembed_batch(client, semaphore, batch[mid:])
+            )
+            return first + second
+        return [item.embedding for item in response.data]
+
+    async def agenerate_batch_embeddings(self, texts, batch_size=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS,
+                                         max_concurrency=MAX_CONCURRENT_REQUESTS):
+        """
+        Generates embeddings for a batch of texts, sending the API calls concurrently.
+
+        Identical texts are embedded once and share the resulting vector.
+
+        Args:
+            texts (list): List of strings to embed
+            batch_size (int): How many texts to embed per API call
+            max_tokens (int): Token budget per API call
+            max_concurrency (int): Maximum number of API calls in flight
+
+        Returns:
+            list: List of embedding vectors, in input order
+        """
+        # Group input positions by a 64-bit content hash so duplicates are embedded only once
+        positions = {}
+        for i, text in enumerate(texts):
+            positions.setdefault(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), []).append(i)
+        unique_texts = [texts[indices[0]] for indices in positions.values()]
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # A fresh client per call keeps its connection pool on the current event loop
+        async with AsyncOpenAI(api_key=self.api_key) as client:
+            results = await asyncio.gather(*(
+                self._aembed_batch(client, semaphore, batch)
+                for batch in self.pack_batches(unique_texts, batch_size, max_tokens)
+            ))
+
+        embeddings = [None] * len(texts)
+        unique_embeddings = (embedding for batch in results for embedding in batch)
+        for embedding, indices in zip(unique_embeddings, positions.values()):
+            for i in indices:
+                embeddings[i] = embedding
+        return embeddings
+
+    def generate_batch_embeddings(self, texts, batch_size=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
         """
         Generates embeddings for a batch of texts.
 
+        Blocking wrapper around agenerate_batch_embeddings for synchronous callers.
+
         Args:
             texts (list): List of strings to embed
             batch_size (int): How many texts to embed per API call
+            max_tokens (int): Token budget per API call
 
         Returns:
             list: List of embedding vectors
         """
-        embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            response = self.client.embeddings.create(model=self.model, input=batch)
-            embeddings.extend([item.embedding for item in response.data])
-        return embeddings
+        return asyncio.run(self.agenerate_batch_embeddings(texts, batch_size, max_tokens))
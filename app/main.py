@@ -6,80 +6,129 @@ Streamlit UI for the RAG GitHub application.
 - Step 3: User can chat with the codebase using GPT-4o mini.
 """
 
+import asyncio
 import streamlit as st
-from agent import build_graph, create_chat_only_state
+from agent import build_graph, create_chat_only_state, get_chroma, parse_repo_url
+from repo_crawler import GitHubRepoCrawler
+from settings import GITHUB_TOKEN
 import time
 
 
+@st.cache_resource
+def _get_graph():
+    """Build the agent graph once per process and share it across all sessions"""
+    return build_graph()
+
+def _invoke_graph(state):
+    """Run the agent graph on its async path, so the chat node's API calls overlap"""
+    return asyncio.run(_get_graph().ainvoke(state))
+
+# Session state keys and their initial values, stored as top-level st.session_state entries
+_SESSION_DEFAULTS = {
+    "repo_url": "",
+    "chat_history": [],
+    "collection_name": "",
+    "owner": "",
+    "repo": "",
+    "processed": False,
+    "valid": False,
+    "error": "",
+    "user_msg_count": 0,
+    "processing": False
+}
+
 # Initialize session state
 def initialize_session_state():
     """Initialize all session state variables"""
-    if "graph" not in st.session_state:
-        st.session_state.graph = build_graph()
-    
-    if "current_state" not in st.session_state:
-        st.session_state.current_state = {
-            "repo_url": "",
-            "chat_history": [],
-            "collection_name": "",
-            "owner": "",
-            "repo": "",
-            "processed": False,
-            "valid": False,
-            "error": ""
-        }
-    
-    if "processing" not in st.session_state:
-        st.session_state.processing = False
+    for key, value in _SESSION_DEFAULTS.items():
+        # Copy mutable defaults so sessions never share the same list
+        st.session_state.setdefault(key, value.copy() if isinstance(value, list) else value)
 
 def reset_session():
     """Reset the session to start fresh"""
-    st.session_state.current_state = {
-        "repo_url": "",
+    for key, value in _SESSION_DEFAULTS.items():
+        st.session_state[key] = value.copy() if isinstance(value, list) else value
+
+def display_message(message):
+    """Display a single chat message"""
+    if message["role"] in ("user", "assistant"):
+        with st.chat_message(message["role"]):
+            st.write(message["content"])
+
+def display_chat_history():
+    """Display the chat history in a nice format"""
+    for message in st.session_state.chat_history:
+        display_message(message)
+
+class _UncachedResult(Exception):
+    """Carries a failed processing result out of the cached function, so that it is not cached"""
+    def __init__(self, result):
+        super().__init__(result.get("error", ""))
+        self.result = result
+
+def _repo_head_sha(repo_url):
+    """Return the current commit SHA of the repository's main branch, or None if it can't be resolved"""
+    parsed = parse_repo_url(repo_url)
+    if parsed is None:
+        return None
+    try:
+        return GitHubRepoCrawler(token=GITHUB_TOKEN).get_head_sha(*parsed)
+    except Exception:
+        return None
+
+def _run_processing(repo_url, head_sha=None):
+    """Run the agent graph in processing mode, at head_sha if one was resolved"""
+    initial_state = {
+        "repo_url": repo_url,
+        "head_sha": head_sha or "",
         "chat_history": [],
-        "collection_name": "",
-        "owner": "",
-        "repo": "",
-        "processed": False,
+        "mode": "process_repo",
         "valid": False,
+        "processed": False,
         "error": ""
     }
-    st.session_state.processing = False
+    return _invoke_graph(initial_state)
 
-def display_chat_history():
-    """Display the chat history in a nice format"""
-    if st.session_state.current_state.get("chat_history"):
-        for i, message in enumerate(st.session_state.current_state["chat_history"]):
-            if message["role"] == "user":
-                with st.chat_message("user"):
-                    st.write(message["content"])
-            elif message["role"] == "assistant":
-                with st.chat_message("assistant"):
-                    st.write(message["content"])
+@st.cache_data(persist="disk", show_spinner=False)
+def _process_repo_cached(repo_url, head_sha):
+    """Process a repository at a given commit; repeat calls for the same commit skip all the work"""
+    result = _run_processing(repo_url, head_sha)
+    if result.get("error") or not result.get("processed"):
+        raise _UncachedResult(result)
+    return {key: result[key] for key in ("collection_name", "owner", "repo", "processed")}
+
+def _process_repo(repo_url, head_sha):
+    """Process a repository at a given commit, reusing the cached run only while its collection is intact"""
+    try:
+        result = _process_repo_cached(repo_url, head_sha)
+        chroma = get_chroma()
+        if not chroma.is_populated(result["collection_name"], head_sha):
+            # The vector store was wiped, the collection deleted, or it was rebuilt at another
+            # commit since the run was cached; drop the stale run and any cached collection handle
+            _process_repo_cached.clear(repo_url, head_sha)
+            chroma.invalidate(result["collection_name"])
+            result = _process_repo_cached(repo_url, head_sha)
+        return result
+    except _UncachedResult as failed:
+        return failed.result
 
 def process_repository(repo_url):
     """Process the repository with proper error handling"""
     try:
-        # Create initial state for processing
-        initial_state = {
-            "repo_url": repo_url,
-            "chat_history": [],
-            "mode": "process_repo",
-            "valid": False,
-            "processed": False,
-            "error": ""
-        }
-        
         # Show processing status
         status_container = st.empty()
         status_container.info("🔄 Processing repository... This may take a few minutes.")
         
-        # Process the repository
-        result = st.session_state.graph.invoke(initial_state)
+        # Process the repository, reusing the previous run if the branch hasn't moved
+        head_sha = _repo_head_sha(repo_url)
+        if head_sha is None:
+            result = _run_processing(repo_url)
+        else:
+            result = _process_repo(repo_url, head_sha)
         
         # Update session state based on result
         if result.get("error"):
-            st.session_state.current_state.update({
+            st.session_state.update({
                 "error": result["error"],
                 "processed": False,
                 "valid": False
@@ -88,7 +137,7 @@ def process_repository(repo_url):
             return False
         
         elif result.get("processed"):
-            st.session_state.current_state.update({
+            st.session_state.update({
                 "repo_url": repo_url,
                 "collection_name": result["collection_name"],
                 "owner": result["owner"],
@@ -96,13 +145,14 @@ def process_repository(repo_url):
                 "processed": True,
                 "valid": True,
                 "error": "",
-                "chat_history": []
+                "chat_history": [],
+                "user_msg_count": 0
             })
             status_container.success("✅ Repository processed successfully! You can now ask questions about the codebase.")
             return True
         
         else:
-            st.session_state.current_state.update({
+            st.session_state.update({
                 "error": "Unknown error occurred during processing",
                 "processed": False,
                 "valid": False
@@ -112,7 +162,7 @@ def process_repository(repo_url):
             
     except Exception as e:
         error_msg = f"Error processing repository: {str(e)}"
-        st.session_state.current_state.update({
+        st.session_state.update({
             "error": error_msg,
             "processed": False,
             "valid": False
@@ -124,20 +174,21 @@ def handle_chat_query(query):
     """Handle a chat query with proper state management"""
     try:
         # Add user message to chat history
-        current_history = st.session_state.current_state.get("chat_history", [])
+        current_history = st.session_state.chat_history
         current_history.append({"role": "user", "content": query})
+        st.session_state.user_msg_count += 1
         
         # Create chat state
         chat_state = create_chat_only_state(
-            collection_name=st.session_state.current_state["collection_name"],
-            owner=st.session_state.current_state["owner"],
-            repo=st.session_state.current_state["repo"],
+            collection_name=st.session_state.collection_name,
+            owner=st.session_state.owner,
+            repo=st.session_state.repo,
             chat_history=current_history
         )
         
         # Get response from the agent
         with st.spinner("🤔 Thinking..."):
-            result = st.session_state.graph.invoke(chat_state)
+            result = _invoke_graph(chat_state)
         
         # Update session state with the result
         if result.get("error"):
@@ -145,23 +196,34 @@ def handle_chat_query(query):
             return
             
         # Update chat history with both user query and assistant response
-        st.session_state.current_state["chat_history"] = result.get("chat_history", current_history)
+        st.session_state.chat_history = result.get("chat_history", current_history)
         
     except Exception as e:
         st.error(f"Error handling chat query: {str(e)}")
 
-# Main app
-def main():
-    # Page configuration
-    st.set_page_config(
-        page_title="GitHub RAG Chatbot",
-        page_icon="🤖",
-        layout="wide",
-        initial_sidebar_state="expanded"
-    )
+def _chat_panel():
+    """Chat interface"""
+    st.subheader(f"💬 Chat with {st.session_state.owner}/{st.session_state.repo}")
+    
+    # Display chat history
+    history = st.container()
+    with history:
+        display_chat_history()
+    
+    # Chat input
+    if query := st.chat_input("Ask a question about the codebase..."):
+        rendered = len(st.session_state.chat_history)
+        # Append the new turn below the history already on the page instead of rerunning to redraw it all
+        with history:
+            display_message({"role": "user", "content": query})
+            handle_chat_query(query)
+            for message in st.session_state.chat_history[rendered + 1:]:
+                display_message(message)
 
-    # Custom CSS for better styling
-    st.markdown("""
+@st.cache_data
+def _css():
+    """Custom CSS for better styling; static, so it is built once and served from the cache"""
+    return """
     <style>
         .main-header {
             text-align: center;
@@ -194,7 +256,62 @@ def main():
             background-color: #fafafa;
         }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+@st.fragment
+def _content():
+    """Chat and repository info panels; sending a message reruns both together, but not the whole app"""
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        # Show current status
+        if st.session_state.error:
+            st.error(f"❌ {st.session_state.error}")
+        
+        elif not st.session_state.processed:
+            st.info("👈 Please enter a GitHub repository URL in the sidebar and click 'Process Repository' to get started.")
+        
+        else:
+            _chat_panel()
+    
+    with col2:
+        # Help and information panel
+        st.subheader("ℹ️ How to Use")
+        st.markdown("""
+        1. **Enter Repository URL**: Paste a GitHub repository URL in the sidebar
+        2. **Process Repository**: Click the process button to analyze the code
+        3. **Start Chatting**: Once processed, ask questions about the codebase
+        
+        **Example Questions:**
+        - "What does this repository do?"
+        - "How is the code organized?"
+        - "Show me the main functions"
+        - "Explain the API endpoints"
+        - "What are the dependencies?"
+        """)
+        
+        # Repository statistics (if available)
+        if st.session_state.processed:
+            st.subheader("📊 Repository Info")
+            st.write(f"**Owner:** {st.session_state.owner}")
+            st.write(f"**Repository:** {st.session_state.repo}")
+            st.write(f"**Collection:** {st.session_state.collection_name}")
+            
+            # Chat statistics
+            st.write(f"**Questions Asked:** {st.session_state.user_msg_count}")
+
+# Main app
+def main():
+    # Page configuration
+    st.set_page_config(
+        page_title="GitHub RAG Chatbot",
+        page_icon="🤖",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
+    # Custom CSS for better styling
+    st.markdown(_css(), unsafe_allow_html=True)
 
     initialize_session_state()
     
@@ -209,9 +326,9 @@ def main():
         st.header("Repository Settings")
         
         # Show current repository status
-        if st.session_state.current_state.get("processed"):
+        if st.session_state.processed:
             st.success(f"📁 Active Repository:")
-            st.write(f"**{st.session_state.current_state['owner']}/{st.session_state.current_state['repo']}**")
+            st.write(f"**{st.session_state.owner}/{st.session_state.repo}**")
             
             if st.button("🔄 Process New Repository", use_container_width=True):
                 reset_session()
@@ -224,7 +341,7 @@ def main():
             # Repository URL input
             repo_url = st.text_input(
                 "GitHub Repository URL:",
-                value=st.session_state.current_state.get("repo_url", ""),
+                value=st.session_state.repo_url,
                 placeholder="https://github.com/owner/repo",
                 help="Enter a valid GitHub repository URL"
             )
@@ -245,54 +362,7 @@ def main():
                 st.warning("⏳ Processing in progress...")
     
     # Main content area
-    col1, col2 = st.columns([3, 1])
-    
-    with col1:
-        # Show current status
-        if st.session_state.current_state.get("error"):
-            st.error(f"❌ {st.session_state.current_state['error']}")
-        
-        elif not st.session_state.current_state.get("processed"):
-            st.info("👈 Please enter a GitHub repository URL in the sidebar and click 'Process Repository' to get started.")
-        
-        else:
-            # Chat interface
-            st.subheader(f"💬 Chat with {st.session_state.current_state['owner']}/{st.session_state.current_state['repo']}")
-            
-            # Display chat history
-            display_chat_history()
-            
-            # Chat input
-            if query := st.chat_input("Ask a question about the codebase..."):
-                handle_chat_query(query)
-                st.rerun()
-    
-    with col2:
-        # Help and information panel
-        st.subheader("ℹ️ How to Use")
-        st.markdown("""
-        1. **Enter Repository URL**: Paste a GitHub repository URL in the sidebar
-        2. **Process Repository**: Click the process button to analyze the code
-        3. **Start Chatting**: Once processed, ask questions about the codebase
-        
-        **Example Questions:**
-        - "What does this repository do?"
-        - "How is the code organized?"
-        - "Show me the main functions"
-        - "Explain the API endpoints"
-        - "What are the dependencies?"
-        """)
-        
-        # Repository statistics (if available)
-        if st.session_state.current_state.get("processed"):
-            st.subheader("📊 Repository Info")
-            st.write(f"**Owner:** {st.session_state.current_state['owner']}")
-            st.write(f"**Repository:** {st.session_state.current_state['repo']}")
-            st.write(f"**Collection:** {st.session_state.current_state['collection_name']}")
-            
-            # Chat statistics
-            chat_count = len([msg for msg in st.session_state.current_state.get("chat_history", []) if msg["role"] == "user"])
-            st.write(f"**Questions Asked:** {chat_count}")
+    _content()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,23 +4,71 @@ repo_crawler.py
 Handles crawling a GitHub repository: listing files and fetching file contents.
 """
 
+import io
+import zipfile
 import requests
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default number of concurrent file fetches, also used as the HTTP connection pool size
+DEFAULT_MAX_WORKERS = 16
+
+# Bulk fetches keep at most this many downloads per worker submitted at once
+FETCH_WINDOW_FACTOR = 2
+
+# Files larger than this (or of unknown size) are read in blocks rather than buffered at once
+STREAM_THRESHOLD = 1024 * 1024
+
+# Extensions of files treated as code or text documentation
+_CODE_EXTS = frozenset({
+    '.py', '.js', '.ts', '.java', '.cpp', '.c', '.h', '.hpp', '.cs', '.php', '.rb', '.go', '.rs', '.swift',
+    '.kt', '.scala', '.r', '.sh', '.html', '.css', '.json', '.yaml', '.yml', '.toml', '.sql', '.md', '.rst'
+})
 
 class GitHubRepoCrawler:
     """
     Interacts with the GitHub API to list and fetch files from a repository.
     """
-    def __init__(self, token=None):
+    def __init__(self, token=None, pool_size=DEFAULT_MAX_WORKERS):
         """
         Args:
             token (str): GitHub personal access token (optional)
+            pool_size (int): Maximum number of pooled connections per host
         """
         self.session = requests.Session()
+        # Size the pool for concurrent fetches so connections are reused rather than discarded,
+        # and back off on rate limiting and transient server errors (honouring Retry-After);
+        # once retries run out the last response is returned so raise_for_status reports it
+        retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         if token:
             self.session.headers.update({'Authorization': f'token {token}'})
         self.session.headers.update({'Accept': 'application/vnd.github.v3+json'})
 
+    def get_head_sha(self, owner, repo, branch="main"):
+        """
+        Resolves the commit SHA a branch currently points to.
+
+        Args:
+            owner (str): Repository owner
+            repo (str): Repository name
+            branch (str): Branch name (default: main)
+
+        Returns:
+            str: The commit SHA
+        """
+        url = f"https://api.github.com/repos/{owner}/{repo}/commits/{branch}"
+        # The sha media type returns just the SHA as plain text instead of the full commit JSON
+        resp = self.session.get(url, headers={'Accept': 'application/vnd.github.sha'})
+        resp.raise_for_status()
+        return resp.text.strip()
+
     def get_files(self, owner, repo, branch="main"):
         """
         Lists all files in a GitHub repository branch.
@@ -39,9 +87,28 @@ class GitHubRepoCrawler:
         # Only return files (blobs), not directories (trees)
         return [item for item in resp.json()['tree'] if item['type'] == 'blob']
 
-    def get_file_content(self, owner, repo, file_path, branch="main"):
+    def filter_code_blobs(self, files, max_file_bytes=None):
         """
-        Fetches the raw content of a file from a GitHub repository.
+        Iterates over the code files of a tree listing, so that non-code and
+        oversized files are dropped before any content is fetched.
+
+        Args:
+            files (list): File metadata dicts from get_files
+            max_file_bytes (int): Skip files of at least this size (optional)
+
+        Yields:
+            dict: File metadata dicts of the code files
+        """
+        for item in files:
+            if not self.is_code_file(item['path']):
+                continue
+            if max_file_bytes is not None and item.get('size', 0) >= max_file_bytes:
+                continue
+            yield item
+
+    def get_file_bytes(self, owner, repo, file_path, branch="main"):
+        """
+        Fetches the raw bytes of a file from a GitHub repository, without decoding them.
 
         Args:
             owner (str): Repository owner
@@ -50,16 +117,123 @@ class GitHubRepoCrawler:
             branch (str): Branch name
 
         Returns:
-            str: File content as text
+            bytes: File content (a bytearray for files above STREAM_THRESHOLD)
         """
         url = f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{file_path}"
-        resp = self.session.get(url)
-        resp.raise_for_status()
-        return resp.text
+        with self.session.get(url, stream=True) as resp:
+            resp.raise_for_status()
+            size = int(resp.headers.get('Content-Length') or 0)
+            if 0 < size <= STREAM_THRESHOLD:
+                return resp.content
+            content = bytearray()
+            for block in resp.iter_content(chunk_size=64 * 1024):
+                content.extend(block)
+            return content
+
+    def get_file_content(self, owner, repo, file_path, branch="main"):
+        """
+        Fetches the content of a file from a GitHub repository, decoded as UTF-8.
+
+        Args:
+            owner (str): Repository owner
+            repo (str): Repository name
+            file_path (str): Path to the file in the repo
+            branch (str): Branch name
+
+        Returns:
+            str: File content as text, with undecodable bytes replaced
+        """
+        return self.get_file_bytes(owner, repo, file_path, branch).decode("utf-8", errors="replace")
+
+    def get_files_content_bulk(self, owner, repo, file_paths, branch="main", max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Fetches the raw content of many files concurrently.
+
+        Args:
+            owner (str): Repository owner
+            repo (str): Repository name
+            file_paths (list): Paths of the files in the repo
+            branch (str): Branch name
+            max_workers (int): Number of files fetched in parallel
+
+        Yields:
+            tuple: (file_path, content) pairs, in the order of file_paths
+        """
+        paths = iter(file_paths)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Keep a bounded window of downloads in flight rather than queueing every path up front
+        pending = deque()
+        def submit(count):
+            for path in islice(paths, count):
+                pending.append((path, executor.submit(self.get_file_content, owner, repo, path, branch)))
+        try:
+            submit(max_workers * FETCH_WINDOW_FACTOR)
+            while pending:
+                path, future = pending.popleft()
+                content = future.result()
+                submit(1)
+                yield path, content
+        finally:
+            # On an error or an abandoned generator, drop the queued downloads instead of waiting for them
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def download_archive(self, owner, repo, branch="main", max_bytes=None):
+        """
+        Downloads a branch as a single ZIP archive, held in memory.
+
+        Args:
+            owner (str): Repository owner
+            repo (str): Repository name
+            branch (str): Branch name
+            max_bytes (int): Abort once the download grows past this size (optional)
+
+        Returns:
+            zipfile.ZipFile: The repository archive
+
+        Raises:
+            ValueError: If the archive is larger than max_bytes
+        """
+        url = f"https://api.github.com/repos/{owner}/{repo}/zipball/{branch}"
+        buffer = io.BytesIO()
+        with self.session.get(url, stream=True) as resp:
+            resp.raise_for_status()
+            for block in resp.iter_content(chunk_size=64 * 1024):
+                buffer.write(block)
+                if max_bytes is not None and buffer.tell() > max_bytes:
+                    raise ValueError(f"Archive of {owner}/{repo} is larger than {max_bytes} bytes")
+        return zipfile.ZipFile(buffer)
+
+    def iter_code_files(self, archive, max_file_bytes=None):
+        """
+        Iterates over the code files of a repository archive.
+
+        GitHub nests every entry under a top-level "<owner>-<repo>-<sha>/" directory,
+        which is stripped so paths match those of get_files.
+
+        Args:
+            archive (zipfile.ZipFile): Archive returned by download_archive
+            max_file_bytes (int): Skip files of at least this uncompressed size (optional)
+
+        Yields:
+            tuple: (file_path, content) pairs
+        """
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            # Zip Slip: never trust absolute paths or parent-directory segments
+            name = info.filename
+            if name.startswith('/') or '\\' in name or '..' in name.split('/'):
+                continue
+            file_path = name.partition('/')[2]
+            if not file_path or not self.is_code_file(file_path):
+                continue
+            if max_file_bytes is not None and info.file_size >= max_file_bytes:
+                continue
+            yield file_path, archive.read(info).decode("utf-8", errors="replace")
 
     def is_code_file(self, file_path):
         """
-        Determines if a file is likely to be code based on its extension.
+        Determines if a file is likely to be code or text documentation based on its extension.
 
         Args:
             file_path (str): Path to the file
@@ -67,5 +241,6 @@ class GitHubRepoCrawler:
         Returns:
             bool: True if file is a code file
         """
-        code_exts = {'.py', '.js', '.ts', '.java', '.cpp', '.c', '.h', '.cs', '.php', '.rb', '.go', '.rs', '.swift', '.kt', '.scala', '.r', '.sh', '.html', '.css', '.json', '.yaml', '.yml', '.sql'}
-        return Path(file_path).suffix.lower() in code_exts
+        # Extension of the last path component, as Path.suffix would give, without building a Path
+        i = file_path.rfind('.')
+        return i > file_path.rfind('/') + 1 and file_path[i:].lower() in _CODE_EXTS
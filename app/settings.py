@@ -18,3 +18,9 @@ GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 
 # Directory where ChromaDB will persist its data
 CHROMA_DB_DIR = os.getenv("CHROMA_DB_DIR", "./chroma_db")
+
+# Files larger than this (in bytes) are skipped when processing a repository
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", 500_000))
+
+# Number of chunks written to ChromaDB per upsert call
+CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 1024))
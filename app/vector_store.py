@@ -4,7 +4,114 @@ vector_store.py
 Handles storing and retrieving code embeddings using ChromaDB.
 """
 
+import asyncio
+from functools import lru_cache
+
 import chromadb
+import numpy as np
+from settings import CHROMA_BATCH_SIZE
+
+try:
+    import numba
+except ImportError:  # Optional: only speeds up reranking of large candidate pools
+    numba = None
+
+# Candidate pools at least this large are reranked with the compiled kernel when numba is installed
+NUMBA_MIN_CANDIDATES = 256
+
+if numba is not None:
+    @numba.njit(fastmath=True, parallel=True, cache=True)
+    def _mmr_kernel(candidates, relevance, k, lambda_mult):
+        """Explicit-loop MMR selection over unit-norm candidates; see mmr_select."""
+        n, dim = candidates.shape
+        selected = np.empty(k, dtype=np.int64)
+        taken = np.zeros(n, dtype=np.bool_)
+        redundancy = np.zeros(n, dtype=np.float32)
+        for step in range(k):
+            # fastmath assumes no infinities, so the first untaken candidate seeds the search
+            best, best_score = -1, 0.0
+            for i in range(n):
+                if taken[i]:
+                    continue
+                score = relevance[i] if step == 0 else lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy[i]
+                if best < 0 or score > best_score:
+                    best, best_score = i, score
+            selected[step] = best
+            taken[best] = True
+            # Redundancy is the highest similarity to any selected candidate
+            for i in numba.prange(n):
+                sim = np.float32(0.0)
+                for d in range(dim):
+                    sim += candidates[i, d] * candidates[best, d]
+                if step == 0 or sim > redundancy[i]:
+                    redundancy[i] = sim
+        return selected
+
+def mmr_select(query_embedding, candidate_embeddings, k, lambda_mult=0.5):
+    """
+    Selects candidates by Maximal Marginal Relevance: each pick maximizes similarity
+    to the query minus similarity to the candidates already picked.
+
+    Args:
+        query_embedding (list): The query vector
+        candidate_embeddings (list): Candidate vectors
+        k (int): Number of candidates to select
+        lambda_mult (float): Trade-off between relevance (1.0) and diversity (0.0)
+
+    Returns:
+        list: Indices of the selected candidates, in selection order
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if len(candidates) == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    # Normalize so that dot products are cosine similarities
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = candidates @ query
+    k = min(k, len(candidates))
+
+    if numba is not None and len(candidates) >= NUMBA_MIN_CANDIDATES:
+        return [int(i) for i in _mmr_kernel(candidates, relevance, k, lambda_mult)]
+
+    # Track each candidate's highest similarity to the selection, one matrix-vector product per pick
+    selected = [int(np.argmax(relevance))]
+    redundancy = candidates @ candidates[selected[0]]
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, candidates @ candidates[best])
+    return selected
+
+@lru_cache(maxsize=None)
+def get_client(persist_directory):
+    """
+    Returns the process-wide persistent client for a directory, opening it on first use.
+
+    Args:
+        persist_directory (str): Directory for ChromaDB data
+
+    Returns:
+        chromadb.PersistentClient: The client
+    """
+    return chromadb.PersistentClient(path=persist_directory)
+
+@lru_cache(maxsize=None)
+def get_collection(persist_directory, collection_name):
+    """
+    Gets or creates a collection once per process; later calls return the cached object.
+
+    Args:
+        persist_directory (str): Directory for ChromaDB data
+        collection_name (str): Name of the collection
+
+    Returns:
+        chromadb.Collection: The collection object
+    """
+    # get_or_create is atomic in Chroma, so concurrent first calls for a new name cannot collide
+    return get_client(persist_directory).get_or_create_collection(name=collection_name, embedding_function=None)
 
 class ChromaDBManager:
     """
@@ -15,7 +122,8 @@ class ChromaDBManager:
         Args:
             persist_directory (str): Directory for ChromaDB data
         """
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.persist_directory = persist_directory
+        self.client = get_client(persist_directory)
 
     def create_or_get_collection(self, collection_name):
         """
@@ -27,25 +135,64 @@ class ChromaDBManager:
         Returns:
             chromadb.Collection: The collection object
         """
+        return get_collection(self.persist_directory, collection_name)
+
+    def is_populated(self, collection_name, head_sha=None):
+        """
+        Checks that a collection exists on disk and holds at least one chunk.
+
+        Args:
+            collection_name (str): Name of the collection
+            head_sha (str): Commit the collection must have been built at (optional)
+
+        Returns:
+            bool: True if the collection can be queried for results
+        """
         try:
-            return self.client.get_collection(collection_name)
+            # Look the collection up afresh; a cached handle may outlive a deleted collection
+            collection = self.client.get_collection(collection_name)
+            if head_sha is not None and (collection.metadata or {}).get("head_sha") != head_sha:
+                return False
+            return collection.count() > 0
         except Exception:
-            # Create collection if it doesn't exist
-            return self.client.create_collection(name=collection_name, embedding_function=None)
+            return False
 
-    def store_chunks(self, collection, chunks, embeddings):
+    def invalidate(self, collection_name):
         """
-        Stores code chunks and their embeddings in ChromaDB.
+        Drops cached collection handles, so the next create_or_get_collection reopens
+        collection_name from disk (recreating it if it was deleted).
+
+        Args:
+            collection_name (str): Name of the collection
+        """
+        # lru_cache cannot evict a single key; the other handles are cheap to reopen
+        get_collection.cache_clear()
+
+    def store_chunks(self, collection, chunks, embeddings, batch_size=CHROMA_BATCH_SIZE):
+        """
+        Stores (or replaces) code chunks and their embeddings in ChromaDB, batch_size rows per call.
 
         Args:
             collection (chromadb.Collection): The collection to store in
-            chunks (list): List of chunk dicts
-            embeddings (list): List of embedding vectors
+            chunks (ChunkBatch): The chunks to store
+            embeddings (list): List of embedding vectors, one per chunk
+            batch_size (int): Maximum number of rows per upsert call
+
+        Returns:
+            list: IDs of the stored rows
         """
-        ids = [f"{chunk['file_path']}_{chunk['start_line']}_{chunk['end_line']}" for chunk in chunks]
-        documents = [chunk['content'] for chunk in chunks]
-        metadatas = [chunk for chunk in chunks]
-        collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+        stored_ids = []
+        for i in range(0, len(chunks), batch_size):
+            ids, metadatas = [], []
+            for path, start, end in zip(chunks.file_paths[i:i + batch_size], chunks.start_lines[i:i + batch_size],
+                                        chunks.end_lines[i:i + batch_size]):
+                ids.append(f"{path}_{start}_{end}")
+                metadatas.append({"file_path": path, "start_line": start, "end_line": end,
+                                  "owner": chunks.owner, "repo": chunks.repo})
+            # Upsert so that re-processing a repository overwrites its existing rows
+            collection.upsert(ids=ids, documents=chunks.contents[i:i + batch_size],
+                              embeddings=embeddings[i:i + batch_size], metadatas=metadatas)
+            stored_ids.extend(ids)
         # # Check total count
         # print(f"Total items in collection: {collection.count()}")
 
@@ -60,16 +207,83 @@ class ChromaDBManager:
         #     print("You have duplicate IDs!")
         # else:
         #     print("No duplicates - ChromaDB rejected the duplicate adds")
-    def query_similar_code(self, collection, query_embedding, n_results=5):
+        return stored_ids
+
+    def finalize_collection(self, collection, keep_ids, head_sha="", batch_size=CHROMA_BATCH_SIZE):
+        """
+        Deletes the rows a processing run did not write, such as chunks of deleted files or of
+        line ranges that moved, and records the commit the collection now reflects.
+
+        Args:
+            collection (chromadb.Collection): The collection that was processed
+            keep_ids (set): IDs of the rows stored by the run
+            head_sha (str): Commit the run processed
+            batch_size (int): Maximum number of rows per delete call
+        """
+        stale = [row_id for row_id in collection.get(include=[])["ids"] if row_id not in keep_ids]
+        for i in range(0, len(stale), batch_size):
+            collection.delete(ids=stale[i:i + batch_size])
+        collection.modify(metadata={"head_sha": head_sha})
+
+    def query_similar_code(self, collection, query_embeddings, n_results=5, include=None):
+        """
+        Queries ChromaDB for code chunks similar to each of several query embeddings
+        in a single call.
+
+        Args:
+            collection (chromadb.Collection): The collection to query
+            query_embeddings (list): The embeddings to search with
+            n_results (int): Number of results to return per query
+            include (list): Fields to return (optional, ChromaDB's default if omitted)
+
+        Returns:
+            dict: Query results from ChromaDB, one result list per query embedding
+        """
+        if include is None:
+            return collection.query(query_embeddings=query_embeddings, n_results=n_results)
+        return collection.query(query_embeddings=query_embeddings, n_results=n_results, include=include)
+
+    def query_similar_code_mmr(self, collection, query_embedding, n_results=5, fetch_k=25, lambda_mult=0.5):
+        """
+        Queries ChromaDB for fetch_k similar chunks and keeps a relevant but diverse
+        subset of n_results using Maximal Marginal Relevance.
+
+        Args:
+            collection (chromadb.Collection): The collection to query
+            query_embedding (list): The embedding to search with
+            n_results (int): Number of results to return
+            fetch_k (int): Number of nearest neighbours to rerank
+            lambda_mult (float): Trade-off between relevance (1.0) and diversity (0.0)
+
+        Returns:
+            dict: Query results in ChromaDB's format, ordered by MMR selection
+        """
+        results = self.query_similar_code(
+            collection, [query_embedding],
+            n_results=max(fetch_k, n_results),
+            include=["documents", "metadatas", "embeddings"]
+        )
+        selected = mmr_select(query_embedding, results["embeddings"][0], n_results, lambda_mult)
+        return {
+            "ids": [[results["ids"][0][i] for i in selected]],
+            "documents": [[results["documents"][0][i] for i in selected]],
+            "metadatas": [[results["metadatas"][0][i] for i in selected]]
+        }
+
+    async def aquery_similar_code_mmr(self, collection, query_embedding, n_results=5, fetch_k=25, lambda_mult=0.5):
         """
-        Queries ChromaDB for code chunks similar to the query embedding.
+        Runs query_similar_code_mmr in a worker thread so the event loop stays free.
 
         Args:
             collection (chromadb.Collection): The collection to query
             query_embedding (list): The embedding to search with
             n_results (int): Number of results to return
+            fetch_k (int): Number of nearest neighbours to rerank
+            lambda_mult (float): Trade-off between relevance (1.0) and diversity (0.0)
 
         Returns:
-            dict: Query results from ChromaDB
+            dict: Query results in ChromaDB's format, ordered by MMR selection
         """
-        return collection.query(query_embeddings=[query_embedding], n_results=n_results)
+        return await asyncio.to_thread(
+            self.query_similar_code_mmr, collection, query_embedding, n_results, fetch_k, lambda_mult
+        )